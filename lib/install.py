@@ -1,13 +1,19 @@
 #!/usr/bin/python3
 
 import subprocess
+import hashlib
 import json
+import tarfile
 import re
 from pathlib import Path
-import glob
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from graphlib import TopologicalSorter
 import argparse
 import logging
 import os
+import shutil
+import threading
+import urllib.request
 
 # Available libraries
 libraries = (
@@ -22,96 +28,273 @@ libraries = (
 # Library getters ==============================================================
 
 
+# Only one library is compiled at a time: every build already uses -j jobs, so
+# running them concurrently would oversubscribe the machine. Downloads,
+# extraction and configuration are free to overlap.
+build_lock = threading.Lock()
+
+# Shared opener for all the downloads. The archives are already compressed, so
+# ask the servers not to encode them again
+opener = urllib.request.build_opener()
+opener.addheaders = [('Accept-Encoding', 'identity')]
+
+# Marker files left in the source folder once a phase completes, so repeated
+# invocations can skip it
+EXTRACTED_SENTINEL = '.sti_extracted'
+CONFIGURED_SENTINEL = '.sti_configured'
+
+
 def check_run(program_return, report):
     if program_return.returncode != 0:
         raise Exception(report)
 
 
+class TeeReader(object):
+    """
+    File-like wrapper that writes everything read from source into sink
+
+    Keyword arguments:
+
+    - source -- The file-like object to read from
+    - sink -- The file-like object receiving a copy of the data
+    """
+
+    def __init__(self, source, sink):
+        self.source = source
+        self.sink = sink
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.sink.write(data)
+        return data
+
+
 class Library(object):
 
     download_folder = None
     install_folder = None
     name = None
     filename = None
+    file_path = None
+    workdir = None
     version = None
+    version_str = None
     requires = ()
     debug = None
     jobs = None
+    # Whether CC/CXX may be wrapped with ccache while building
+    use_ccache = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # ('curl') is a str, not a tuple: iterating it yields characters
+        if not isinstance(cls.requires, tuple):
+            raise Exception(f"{cls.__name__}.requires must be a tuple")
+
+    def set_paths(self, download_folder: Path, install_folder: Path):
+        """Set the folders, and the archive and sources paths inside them"""
+        self.download_folder = download_folder
+        self.install_folder = install_folder
+        self.file_path = download_folder/self.filename
+        self.workdir = download_folder/self.filename.rsplit('.tar', 1)[0]
+
+    @property
+    def extracted(self):
+        return (self.workdir/EXTRACTED_SENTINEL).exists()
+
+    def clear_sentinels(self):
+        """Remove the phase markers, forcing extraction and configuration"""
+        for sentinel in (EXTRACTED_SENTINEL, CONFIGURED_SENTINEL):
+            (self.workdir/sentinel).unlink(missing_ok=True)
+
+    def build_env(self):
+        """Environment used to configure and compile the library"""
+        try:
+            return self._env_cache
+        except AttributeError:
+            pass
 
+        env = os.environ.copy()
+
+        if self.requires:
+            # Manually set the curl include and lib folders
+            env['LDFLAGS'] = ' '.join(
+                [f"-L{self.install_folder/l/'lib'}" for l in self.requires])
+            env['CPPFLAGS'] = ' '.join(
+                [f"-I{self.install_folder/l/'include'}" for l in self.requires])
+
+        if self.debug:
+            if 'CPPFLAGS' in env:
+                env['CPPFLAGS'] += (' -g')
+            else:
+                env['CPPFLAGS'] = '-g'
+
+        self._env_cache = env
+        return env
+
+    def cache_path(self, url):
+        """Where the archive downloaded from url is stored, keyed by the url hash"""
+        digest = hashlib.sha256(url.encode()).hexdigest()[:16]
+        return self.download_folder/f"{digest}_{self.filename}"
+
+    def cache_is_fresh(self, url, cached):
+        """Compare the cached archive size against the one reported by the server"""
+
+        # Only HTTP supports HEAD, trust the cache for the rest (FTP)
+        if not url.startswith(('http://', 'https://')):
+            return True
+
+        try:
+            request = urllib.request.Request(url, method='HEAD')
+            with opener.open(request) as response:
+                length = response.headers.get('Content-Length')
+        except OSError:
+            # The server is unreachable, use whatever is on disk
+            return True
+
+        return length is None or int(length) == cached.stat().st_size
 
     def download(self):
         """Download the given Library"""
 
-        self.file_path = f"{self.download_folder}/{self.filename}"
+        url = self.download_url()
+        cached = self.cache_path(url)
+
+        # Archives downloaded by older versions of this script are stored
+        # directly under the file name, move them into the cache so they are
+        # revalidated like any other entry
+        if self.file_path.exists() and not self.file_path.is_symlink():
+            if cached.exists():
+                self.file_path.unlink()
+            else:
+                self.file_path.rename(cached)
 
-        # Check if file already exists
-        if glob.glob(self.file_path):
-            logging.info(f"{self.name} already downloaded, skipping")
-            return
+        if cached.exists():
+            if self.cache_is_fresh(url, cached):
+                logging.info(f"{self.name} already downloaded, skipping")
+                self.link_cached(cached)
+                return
 
-        # Download boost with wget
-        url = self.download_url()
-        logging.info(f"Downloading {self.name} from {url}")
+            logging.info(f"{self.name} changed upstream, downloading again")
+            cached.unlink()
+            self.clear_sentinels()
 
-        wget_output = subprocess.run(['wget', url, '-O', self.file_path])
+        logging.info(f"Downloading {self.name} from {url}")
 
-        if wget_output.returncode == 0:
-            print(f"{self.name} {'.'.join(self.version)} downloaded")
-        else:
+        try:
+            self.stream_download_and_extract(url, cached)
+        except Exception as e:
+            # Don't leave a partial file behind, it would be taken as complete
+            # in the next run
+            cached.unlink(missing_ok=True)
             raise Exception(
-                f"{self.name} {'.'.join(self.version)} download failed")
+                f"{self.name} {self.version_str} download failed") from e
+
+        self.link_cached(cached)
+        self.evict_stale_cache(cached)
+        print(f"{self.name} {self.version_str} downloaded")
+
+    def evict_stale_cache(self, keep):
+        """
+        Remove the archives of other versions of this library, or of other
+        urls for this version, and the links to them
+
+        Keyword arguments:
+
+        - keep -- The cached archive in use, which is not removed
+        """
+        for separator in ('.', '_'):
+            version = separator.join(self.version)
+            if version in self.filename:
+                prefix, suffix = self.filename.split(version, 1)
+                break
+        else:
+            return
+
+        # i.e. [<url hash>_]mpich-<any version>.tar.gz
+        stale = re.compile(rf"(?:[0-9a-f]{{16}}_)?{re.escape(prefix)}"
+                           rf"\d+(?:[._]\d+)*{re.escape(suffix)}")
+        for entry in self.download_folder.iterdir():
+            if entry in (keep, self.file_path) or entry.is_dir():
+                continue
+            if stale.fullmatch(entry.name):
+                logging.info(f"Removing stale download {entry.name}")
+                entry.unlink()
+
+    def link_cached(self, cached):
+        """Point the expected archive file name to the cached archive"""
+        self.file_path.unlink(missing_ok=True)
+        self.file_path.symlink_to(cached.name)
+
+    def stream_download_and_extract(self, url, destination):
+        """Extract the archive while it is downloaded, keeping a copy in destination"""
+
+        with opener.open(url) as response, open(destination, 'wb') as f:
+            stream = TeeReader(response, f)
+            with tarfile.open(fileobj=stream, mode='r|*', bufsize=1 << 18) as tar:
+                tar.extractall(self.download_folder)
+
+            # The tar reader may stop before the end of the archive (padding),
+            # copy the rest so the file on disk is complete
+            shutil.copyfileobj(response, f, length=1 << 20)
+
+        (self.workdir/EXTRACTED_SENTINEL).touch()
 
     def extract(self):
         """Extact the already downloaded file"""
 
         logging.info(f"Extracting {self.name}")
-        tar_output = subprocess.run(['tar', '-xf', self.file_path,
+
+        # Use a parallel decompressor if there is one available
+        tar_command = ['tar']
+        if self.filename.endswith('.bz2') and shutil.which('lbzip2'):
+            tar_command += ['-I', 'lbzip2']
+        elif self.filename.endswith('.gz') and shutil.which('pigz'):
+            tar_command += ['-I', 'pigz']
+
+        tar_output = subprocess.run([*tar_command, '-xf', self.file_path,
                                      '--directory', self.download_folder])
 
         check_run(tar_output, f"Error extracting {self.name}")
+        (self.workdir/EXTRACTED_SENTINEL).touch()
 
-    def generic_make_install(self, workdir, cfg_cmd, extra_env={}, extract=True):
+    def generic_make_install(self, cfg_cmd, extra_env={}, extract=True):
         """Install the already downloaded library"""
-        if extract:
+        env = {**self.build_env(), **extra_env}
+
+        if extract and not self.extracted:
             self.extract()
 
         logging.info(f"Installing {self.name}")
 
-        env = os.environ.copy()
-
-        if self.requires:
-            # Manually set the curl include and lib folders
-            env['LDFLAGS'] = ' '.join(
-                [f"-L{self.install_folder}/{l}/lib" for l in self.requires])
-            env['CPPFLAGS'] = ' '.join(
-                [f"-I{self.install_folder}/{l}/include" for l in self.requires])
-
-        if self.debug:
-            if 'CPPFLAGS' in env:
-                env['CPPFLAGS'] += (' -g')
-            else:
-                env['CPPFLAGS'] = '-g'
-
-        env = {**env, **extra_env}
+        # Cache object files between reinstalls. ccache reads CCACHE_DIR from
+        # the environment, if the user has set one
+        if self.use_ccache and shutil.which('ccache'):
+            for var, default in (('CC', 'cc'), ('CXX', 'c++')):
+                compiler = str(env.get(var, default))
+                if not compiler.startswith('ccache'):
+                    env[var] = f"ccache {compiler}"
 
         # Some libraries don't use configure, so check first
-        if cfg_cmd:
+        if cfg_cmd and not (self.workdir/CONFIGURED_SENTINEL).exists():
             configure_output = subprocess.run(cfg_cmd,
-                                              cwd=workdir,
+                                              cwd=self.workdir,
                                               env=env)
 
             check_run(configure_output, f"Error configuring {self.name}")
+            (self.workdir/CONFIGURED_SENTINEL).touch()
 
-        compile_output = subprocess.run(['make', '-j', str(self.jobs), 'all'],
-                                        cwd=workdir,
-                                        env=env)
+        with build_lock:
+            compile_output = subprocess.run(['make', '-j', str(self.jobs), 'all'],
+                                            cwd=self.workdir,
+                                            env=env)
 
-        check_run(compile_output, f"Error compiling {self.name}")
+            check_run(compile_output, f"Error compiling {self.name}")
 
-        install_output = subprocess.run(
-            ['make', 'install'], cwd=workdir, env=env)
+            install_output = subprocess.run(
+                ['make', '-j', str(self.jobs), 'install'], cwd=self.workdir, env=env)
 
-        check_run(install_output, f"Error installing {self.name}")
+            check_run(install_output, f"Error installing {self.name}")
 
 
 class Curl(Library):
@@ -121,10 +304,9 @@ class Curl(Library):
 
     def __init__(self, version, download_folder, install_folder, args):
         self.version = version.split('.')
-        self.filename = f"curl-{'.'.join(self.version)}.tar.bz2"
-
-        self.download_folder = download_folder
-        self.install_folder = install_folder
+        self.version_str = '.'.join(self.version)
+        self.filename = f"curl-{self.version_str}.tar.bz2"
+        self.set_paths(download_folder, install_folder)
         self.jobs = args.jobs
         self.debug = args.debug
 
@@ -133,49 +315,45 @@ class Curl(Library):
 
     def install(self):
         """Install the already downloaded library"""
-        # Subscripting to remove the trailing extension '.tar.gz'
-        workdir = f"{self.download_folder}/{self.filename[:-8]}"
-
-        super().generic_make_install(workdir,
-                                     ['./configure',
-                                      f"--prefix={self.install_folder}/{self.name}"])
+        super().generic_make_install(['./configure',
+                                      f"--prefix={self.install_folder/self.name}"])
 
 
 class MPICH(Library):
 
     name = 'mpich'
-    requires = ('curl')
+    requires = ('curl',)
+    # configure records CC/CXX inside the installed mpicc/mpicxx wrappers,
+    # ccache must not end up in the toolchain used by everything else
+    use_ccache = False
 
     def __init__(self, version, download_folder, install_folder, args):
         self.version = version.split('.')
-        self.filename = f"mpich-{'.'.join(self.version)}.tar.gz"
-        self.download_folder = download_folder
-        self.install_folder = install_folder
+        self.version_str = '.'.join(self.version)
+        self.filename = f"mpich-{self.version_str}.tar.gz"
+        self.set_paths(download_folder, install_folder)
         self.jobs = args.jobs
         self.debug = args.debug
 
     def download_url(self):
-        return f"https://www.mpich.org/static/downloads/{'.'.join(self.version)}/{self.filename}"
+        return f"https://www.mpich.org/static/downloads/{self.version_str}/{self.filename}"
 
     def install(self):
-        workdir = f"{self.download_folder}/{self.filename[:-7]}"
-
-        super().generic_make_install(workdir,
-                                     ['./configure',
-                                      f"--prefix={self.install_folder}/{self.name}/",
+        super().generic_make_install(['./configure',
+                                      f"--prefix={self.install_folder/self.name}/",
                                       '--disable-fortran'])
 
 
 class Netcdf(Library):
 
     name = 'netcdf'
-    requires = ('curl')
+    requires = ('curl',)
 
     def __init__(self, version, download_folder, install_folder, args):
         self.version = version.split('.')
-        self.filename = f"netcdf-{'.'.join(self.version)}.tar.gz"
-        self.download_folder = download_folder
-        self.install_folder = install_folder
+        self.version_str = '.'.join(self.version)
+        self.filename = f"netcdf-{self.version_str}.tar.gz"
+        self.set_paths(download_folder, install_folder)
         self.jobs = args.jobs
         self.debug = args.debug
 
@@ -183,11 +361,9 @@ class Netcdf(Library):
         return f"ftp://ftp.unidata.ucar.edu/pub/netcdf/old/{self.filename}"
 
     def install(self):
-        workdir = f"{self.download_folder}/{self.filename[:-7]}"
-
-        super().generic_make_install(workdir, ['./configure',
-                                               f"--prefix={self.install_folder}/{self.name}/",
-                                               '--disable-netcdf-4'])
+        super().generic_make_install(['./configure',
+                                      f"--prefix={self.install_folder/self.name}/",
+                                      '--disable-netcdf-4'])
 
 
 class Netcdfcxx(Library):
@@ -198,9 +374,9 @@ class Netcdfcxx(Library):
 
     def __init__(self, version, download_folder, install_folder, args):
         self.version = version.split('.')
-        self.filename = f"netcdf-cxx-{'.'.join(self.version)}.tar.gz"
-        self.download_folder = download_folder
-        self.install_folder = install_folder
+        self.version_str = '.'.join(self.version)
+        self.filename = f"netcdf-cxx-{self.version_str}.tar.gz"
+        self.set_paths(download_folder, install_folder)
         self.jobs = args.jobs
         self.debug = args.debug
 
@@ -208,48 +384,49 @@ class Netcdfcxx(Library):
         return f"ftp://ftp.unidata.ucar.edu/pub/netcdf/{self.filename}"
 
     def install(self):
-        workdir = f"{self.download_folder}/{self.filename[:-7]}"
-
-        super().generic_make_install(workdir, ['./configure',
-                                               f"--prefix={self.install_folder}/{self.name}/"])
+        super().generic_make_install(['./configure',
+                                      f"--prefix={self.install_folder/self.name}/"])
 
 
 class Boost(Library):
 
     name = 'boost'
-    requires = ('mpich')
+    requires = ('mpich',)
     boost_libs = ('system', 'filesystem', 'mpi', 'serialization', 'json')
 
     def __init__(self, version, download_folder, install_folder, args):
         self.version = version.split('.')
+        self.version_str = '.'.join(self.version)
         self.filename = f"boost_{'_'.join(self.version)}.tar.bz2"
-        self.download_folder = download_folder
-        self.install_folder = install_folder
+        self.set_paths(download_folder, install_folder)
         self.mpi_compiler = args.mpi_compiler
         self.jobs = args.jobs
         self.debug = args.debug
 
     def download_url(self):
-        return f"https://sourceforge.net/projects/boost/files/boost/{'.'.join(self.version)}/{self.filename}/download"
+        return f"https://sourceforge.net/projects/boost/files/boost/{self.version_str}/{self.filename}/download"
 
     def install(self):
         """Install the already downloaded library"""
-        super().extract()
+        if not self.extracted:
+            super().extract()
 
         logging.info(f"Installing {self.name}")
-        workdir = f"{self.download_folder}/{self.filename[:-8]}"
 
-        bootstrap = subprocess.run(['./bootstrap.sh',
-                                    f"--prefix={self.install_folder}/boost/",
-                                    f"--with-libraries={','.join(self.boost_libs)}"],
-                                   cwd=workdir)
+        if not (self.workdir/CONFIGURED_SENTINEL).exists():
+            bootstrap = subprocess.run(['./bootstrap.sh',
+                                        f"--prefix={self.install_folder/'boost'}/",
+                                        f"--with-libraries={','.join(self.boost_libs)}"],
+                                       cwd=self.workdir)
+
+            if bootstrap.returncode != 0:
+                raise Exception('Error while running Boost bootstrap')
 
-        if bootstrap.returncode != 0:
-            raise Exception('Error while running Boost bootstrap')
+            # Set the mpi version explicitly
+            with open(self.workdir/'project-config.jam', 'a') as config:
+                config.write(f"using mpi : {self.mpi_compiler} ;")
 
-        # Set the mpi version explicitly
-        with open(f"{workdir}/project-config.jam", 'a') as config:
-            config.write(f"using mpi : {self.mpi_compiler} ;")
+            (self.workdir/CONFIGURED_SENTINEL).touch()
 
         # Compile and install
         boost_command = ['./b2',
@@ -261,8 +438,9 @@ class Boost(Library):
                          ]
         if self.debug:
             boost_command.append('--debug-symbols=on')
-        install_output = subprocess.run(boost_command,
-                                        cwd=workdir)
+        with build_lock:
+            install_output = subprocess.run(boost_command,
+                                            cwd=self.workdir)
 
         check_run(install_output, f"Error compiling and install Boost")
 
@@ -275,8 +453,10 @@ class Repast(Library):
 
     def __init__(self, version, download_folder, install_folder, args):
         self.version = version.split('.')
+        self.version_str = '.'.join(self.version)
         self.download_folder = download_folder
         self.install_folder = install_folder
+        self.workdir = download_folder/'repast.hpc'/'release'
         self.jobs = args.jobs
         self.mpi_compiler = args.mpi_compiler
         self.debug = args.debug
@@ -286,49 +466,60 @@ class Repast(Library):
 
     def download(self):
 
-        repo_folder = Path(f"{self.download_folder}/repast.hpc")
+        repo_folder = self.download_folder/'repast.hpc'
 
+        # Only the tip of the development branch is needed. A shallow fetch
+        # doesn't share history with the old tip, so it can't be merged or
+        # fast-forwarded, move the checkout to the fetched commit instead
         if repo_folder.is_dir():
-            git_output = subprocess.run(['git', 'pull'], cwd=repo_folder)
+            git_output = subprocess.run(['git', 'fetch', '--depth=1',
+                                         'origin', 'development'],
+                                        cwd=repo_folder)
+            if git_output.returncode == 0:
+                git_output = subprocess.run(['git', 'reset', '--hard', 'FETCH_HEAD'],
+                                            cwd=repo_folder)
         else:
             git_output = subprocess.run(['git',
-                                         'clone', 'https://github.com/repast/repast.hpc.git',
-                                         repo_folder.absolute()])
-        
-        git_switch = subprocess.run(['git',
-                                        'switch', 'development'],
-                                        cwd=repo_folder.absolute())
+                                         'clone', '--depth=1', '--single-branch',
+                                         '--branch=development',
+                                         'https://github.com/repast/repast.hpc.git',
+                                         str(repo_folder)])
 
         check_run(git_output, 'Error cloning repast repository')
-        check_run(git_switch, 'Error switching to development branch')
+
     def install(self):
 
-        workdir = Path(f"{self.download_folder}/repast.hpc/release")
         try:
-            workdir.mkdir()
+            self.workdir.mkdir()
         except:
             pass
 
         # Depending of the compilation type, copy the debug or release makefile
-        if self.debug:
-            cp_output = subprocess.run(
-                ['cp', f"{self.download_folder}/../Makefile.debug.repast", './Makefile'], cwd=workdir)
-        else: 
-            cp_output = subprocess.run(
-                            ['cp', f"{self.download_folder}/../Makefile.release.repast", './Makefile'], cwd=workdir)
-                            
-        check_run(cp_output, 'Error copying repast Makefile')
+        build_type = 'debug' if self.debug else 'release'
+        try:
+            shutil.copyfile(self.download_folder.parent/f"Makefile.{build_type}.repast",
+                            self.workdir/'Makefile')
+        except OSError as e:
+            raise Exception('Error copying repast Makefile') from e
 
         env_vars = {
             'CC': self.mpi_compiler,
             'BASE_DIR': self.install_folder,
-            'PREFIX': f"{self.install_folder}/{self.name}"
+            'PREFIX': str(self.install_folder/self.name)
         }
 
-        super().generic_make_install(workdir, [],
+        super().generic_make_install([],
                                      extra_env=env_vars, extract=False)
 
 
+def available_cpus():
+    """Number of CPUs this process may run on, honoring affinity masks"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
 if (__name__ == '__main__'):
 
     parser = argparse.ArgumentParser(description='Library downloader. '
@@ -341,12 +532,14 @@ if (__name__ == '__main__'):
                         help='Download directory')
     parser.add_argument('--install-folder', default='.',
                         help='Installation directory')
-    parser.add_argument('-j', '--jobs', default=1, type=int,
-                        help='Number of workers used for compilation')
+    parser.add_argument('-j', '--jobs', default=available_cpus(), type=int,
+                        help='Number of workers used for compilation, defaults to the number of usable CPUs')
     parser.add_argument('-g', '--debug', action='store_true',
                         help='Pass the -g flag to the compiler to generate debug info')
     parser.add_argument('--mpi-compiler', default='./mpich/bin/mpicxx',
                         help='MPI compiler needed by Boost')
+    parser.add_argument('--force', action='store_true',
+                        help='Extract and configure again, even if a previous run already did it')
 
     logging.getLogger().setLevel(logging.DEBUG)
     args = parser.parse_args()
@@ -374,14 +567,40 @@ if (__name__ == '__main__'):
     if 'all' in args.libs:
         args.libs = libraries
 
-    for lib_str in args.libs:
+    classes = {LibClass.name: LibClass for LibClass in Library.__subclasses__()}
 
-        for LibClass in Library.__subclasses__():
-            if LibClass.name == lib_str:
-                lib = LibClass(lib_versions[lib_str],
-                               download_folder.absolute(),
-                               install_folder.absolute(),
-                               args)
-
-        lib.download()
-        lib.install()
+    libs = {}
+    for lib_str in args.libs:
+        libs[lib_str] = classes[lib_str](lib_versions[lib_str],
+                                         download_folder.absolute(),
+                                         install_folder.absolute(),
+                                         args)
+        if args.force:
+            libs[lib_str].clear_sentinels()
+
+    # Only the requested libraries take part in the dependency graph, the rest
+    # are assumed to be already installed
+    deps = {name: {r for r in lib.requires if r in libs}
+            for name, lib in libs.items()}
+
+    # Downloads are independent, start all of them right away. Each install
+    # waits for its own download and for the installation of its dependencies
+    with ThreadPoolExecutor(max_workers=2 * len(libs)) as executor:
+        downloads = {name: executor.submit(lib.download)
+                     for name, lib in libs.items()}
+
+        def install(name):
+            downloads[name].result()
+            libs[name].install()
+
+        sorter = TopologicalSorter(deps)
+        sorter.prepare()
+        installs = {}
+        while sorter.is_active():
+            for name in sorter.get_ready():
+                installs[executor.submit(install, name)] = name
+
+            done, _ = wait(installs, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+                sorter.done(installs.pop(future))
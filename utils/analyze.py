@@ -1,30 +1,35 @@
 #!/usr/bin/python3
 
 import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
-plt.style.use('ggplot')
 import argparse
 
-parser = argparse.ArgumentParser(description='Plot performance')
-parser.add_argument('-i', '--include', action='append',
-                    help='Regular expression of the labels to plot')
-args = parser.parse_args()
 
-df = pd.read_csv('/home/martin/Repositories/sti-hpc/utils/benchmark.csv')
+def main():
+    plt.style.use('ggplot')
 
-plot_df = pd.DataFrame()
+    parser = argparse.ArgumentParser(description='Plot performance')
+    parser.add_argument('-i', '--include', action='append',
+                        help='Regular expression of the labels to plot')
+    args = parser.parse_args()
 
-for regex in args.include:
-    plot_df = plot_df.append(df[df['label'].str.match(regex)])
+    df = pd.read_csv('/home/martin/Repositories/sti-hpc/utils/benchmark.csv',
+                     usecols=['label', 'time'], dtype={'label': str, 'time': str})
+    df['time'] = pd.to_timedelta(df['time'])
 
-plot_df['time'] = pd.to_timedelta(plot_df['time'])
-res = plot_df[['label', 'time']].groupby('label').apply(lambda x: np.mean(x))
-res['std'] = plot_df[['label', 'time']].groupby('label').apply(lambda x: np.std(x))
+    include = '|'.join(f"(?:{regex})" for regex in args.include)
+    plot_df = df.loc[df['label'].str.match(include)].copy()
 
-plot_df['time'] = plot_df['time'].dt.total_seconds()
-ax = plot_df.boxplot(by='label', column='time', rot='90')
+    grouped = plot_df.groupby('label')['time']
+    res = pd.DataFrame({'mean': grouped.mean(), 'std': grouped.std(ddof=0)})
 
-ax.set_ylim(0)
-plt.show()
-print(res)
+    plot_df['time'] = plot_df['time'].dt.total_seconds()
+    ax = plot_df.boxplot(by='label', column='time', rot='90')
+
+    ax.set_ylim(0)
+    plt.show()
+    print(res)
+
+
+if __name__ == '__main__':
+    main()
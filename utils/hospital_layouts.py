@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+"""
+Reference hospital shared by the benchmark, calibration and validation
+scripts
+"""
+import functools
+import numpy as np
+import pandas as pd
+import simulation as sim
+
+WIDTH = 53
+HEIGHT = 36
+
+
+# Parameters that do not change between runs, shared by every hospital
+INCUBATION_TIME = {
+    'min': sim.TimePeriod(0, 14, 0, 0),
+    'max': sim.TimePeriod(6, 0,  0, 0)
+}
+
+CLEANING_INTERVAL = sim.TimePeriod(1, 0, 0, 0)
+
+ICU = {
+    'beds': 90,
+    'sleep_times': [
+        {
+            'time': sim.TimePeriod(2, 14, 24, 0),
+            'probability': 0.004748328
+        },
+        {
+            'time': sim.TimePeriod(3, 0, 0, 0),
+            'probability': 0.088623115
+        },
+        {
+            'time': sim.TimePeriod(3, 7, 12, 0),
+            'probability': 0.017333166
+        },
+        {
+            'time': sim.TimePeriod(3, 16, 48, 0),
+            'probability': 0.032968386
+        },
+        {
+            'time': sim.TimePeriod(4, 4, 48, 0),
+            'probability': 0.013086353
+        },
+        {
+            'time': sim.TimePeriod(4, 9, 36, 0),
+            'probability': 0.100335789
+        },
+        {
+            'time': sim.TimePeriod(4, 16, 48, 0),
+            'probability': 0.066380434
+        },
+        {
+            'time': sim.TimePeriod(4, 21, 36, 0),
+            'probability': 0.000017555
+        },
+        {
+            'time': sim.TimePeriod(6, 7, 12, 0),
+            'probability': 0.007899849
+        },
+        {
+            'time': sim.TimePeriod(6, 9, 36, 0),
+            'probability': 0.100224175
+        },
+        {
+            'time': sim.TimePeriod(6, 12, 0, 0),
+            'probability': 0.084432757
+        },
+        {
+            'time': sim.TimePeriod(6, 16, 48, 0),
+            'probability': 0.117953925
+        },
+        {
+            'time': sim.TimePeriod(7, 9, 36, 0),
+            'probability': 0.053206605
+        },
+        {
+            'time': sim.TimePeriod(8, 0, 0, 0),
+            'probability': 0.026187069
+        },
+        {
+            'time': sim.TimePeriod(9, 4, 48, 0),
+            'probability': 0.122177398
+        },
+        {
+            'time': sim.TimePeriod(9, 7, 12, 0),
+            'probability': 0.033379033
+        },
+        {
+            'time': sim.TimePeriod(10, 4, 48, 0),
+            'probability': 0.037753818
+        },
+        {
+            'time': sim.TimePeriod(29, 16, 48, 0),
+            'probability': 0.094000000
+        }
+    ]
+}
+
+RECEPTION = {
+    'attention_time': sim.TimePeriod(0, 0, 1, 0)
+}
+
+TRIAGE = {
+    'icu': {
+        'death_probability': 0.255,
+        'probability': 0.070724557
+    },
+    'doctors_probabilities': [
+        {
+            'specialty': 'general_practitioner',
+            'probability': 0.444567551
+        },
+        {
+            'specialty': 'psychiatrist',
+            'probability': 0.045610876
+        },
+        {
+            'specialty': 'surgeon',
+            'probability': 0.292939085
+        },
+        {
+            'specialty': 'pediatry',
+            'probability': 0.051335318
+        },
+        {
+            'specialty': 'gynecologist',
+            'probability': 0.075895021
+        },
+        {
+            'specialty': 'geriatrics',
+            'probability': 0.018927592
+        },
+    ],
+    'levels': [
+        {
+            'level': 1,
+            'probability': 0.0418719,
+            'wait_time': sim.TimePeriod(0, 0, 0, 0)
+        },
+        {
+            'level': 2,
+            'probability': 0.0862069,
+            'wait_time': sim.TimePeriod(0, 0, 15, 0)
+        },
+        {
+            'level': 3,
+            'probability': 0.6305419,
+            'wait_time': sim.TimePeriod(0, 1, 0, 0)
+        },
+        {
+            'level': 4,
+            'probability': 0.2266010,
+            'wait_time': sim.TimePeriod(0, 2, 0, 0)
+        },
+        {
+            'level': 5,
+            'probability': 0.0147783,
+            'wait_time': sim.TimePeriod(0, 4, 0, 0)
+        }
+    ],
+    'attention_time': sim.TimePeriod(0, 0, 15, 0)
+}
+
+DOCTORS = [
+    {
+        'attention_duration': sim.TimePeriod(0, 0, 15, 0),
+        'specialty': 'general_practitioner'
+    },
+    {
+        'attention_duration': sim.TimePeriod(0, 0, 15, 0),
+        'specialty': 'psychiatrist'
+    },
+    {
+        'attention_duration': sim.TimePeriod(0, 0, 15, 0),
+        'specialty': 'surgeon'
+    },
+    {
+        'attention_duration': sim.TimePeriod(0, 0, 15, 0),
+        'specialty': 'gynecologist'
+    },
+    {
+        'attention_duration': sim.TimePeriod(0, 0, 15, 0),
+        'specialty': 'geriatrics'
+    },
+    {
+        'attention_duration': sim.TimePeriod(0, 0, 15, 0),
+        'specialty': 'pediatry'
+    },
+]
+
+PERSONNEL = {
+    'immunity': 0.81
+}
+
+
+@functools.lru_cache(maxsize=1)
+def hospital_elements() -> tuple:
+    """The elements of the hospital building, built only once"""
+    hospital = sim.Hospital(WIDTH, HEIGHT)
+
+    walls = np.concatenate([
+        # Borders
+        sim.coordinates(range(WIDTH), (0, HEIGHT - 1)),
+        sim.coordinates((0, WIDTH - 1), range(HEIGHT)),
+        # Left wing
+        sim.coordinates(9, np.setdiff1d(range(36), (4, 5, 13, 19, 25, 31))),
+        sim.coordinates(range(9), (10, 16, 22, 28)),
+        # Doctor offices
+        sim.coordinates(14, np.setdiff1d(range(9), (5, 6))),
+        sim.coordinates((14, 23, 32, 41), range(9, 19)),
+        sim.coordinates(range(14, 52), 9),
+        sim.coordinates(np.setdiff1d(range(14, 52),
+                                     (19, 28, 38, 46, 18, 27, 36, 45)), 18),
+        # Triage
+        sim.coordinates(range(29, 52), 23),
+        sim.coordinates(np.setdiff1d(range(29, 40), (34, 35)), 28),
+        sim.coordinates((29, 39), range(23, 28)),
+    ])
+    hospital.add_walls(np.unique(walls, axis=0))
+
+    hospital.add_element(sim.Entry((WIDTH-9, HEIGHT-1)))
+    hospital.add_element(sim.Exit((WIDTH-8, HEIGHT-1)))
+    hospital.add_element(sim.ICU((20, 5)))
+
+    for y in (25, 31):
+        hospital.add_element(sim.DoctorOffice(
+            'general_practitioner', (3, y), (4, y)))
+    hospital.add_element(sim.DoctorOffice('psychiatrist', (3, 5), (4, 5)))
+    hospital.add_element(sim.DoctorOffice('surgeon', (18, 13), (18, 14)))
+    hospital.add_element(sim.DoctorOffice('pediatry', (27, 13), (27, 14)))
+    hospital.add_element(sim.DoctorOffice('gynecologist', (36, 13), (36, 14)))
+    hospital.add_element(sim.DoctorOffice('geriatrics', (45, 13), (45, 14)))
+
+    hospital.add_element(sim.Receptionist((45, 25), (45, 27)))
+
+    hospital.add_element(sim.Triage((32, 25)))
+    hospital.add_element(sim.Triage((34, 25)))
+    hospital.add_element(sim.Triage((36, 25)))
+
+    for x in range(14, 28, 2):
+        for y in range(22, 31, 2):
+            hospital.add_element(sim.Chair((x, y)))
+
+    return tuple(hospital.elements)
+
+
+@functools.lru_cache(maxsize=1)
+def reference_tables() -> tuple:
+    """The yearly admissions and the daily distribution references"""
+    year = pd.read_csv('admission_reference.csv')
+    day = pd.read_csv('day_distribution_reference.csv').to_numpy()
+    return year, day
+
+
+def preload():
+    """
+    Build the cached geometry and reference tables, meant to be used as a
+    multiprocessing.Pool initializer so every worker pays for them once
+    """
+    hospital_elements()
+    reference_tables()
+
+
+@functools.lru_cache(maxsize=8)
+def make_hospital(patients,
+                  human_infection,
+                  human_contamination,
+                  chair_infection,
+                  bed_infection,
+                  icu_chance,
+                  walk_speed=2.0) -> sim.Hospital:
+    """
+    Create the reference hospital with the given infection parameters. The
+    validated hospital is cached and shared between calls with the same
+    arguments, so it must not be modified
+
+    Keyword arguments:
+
+    - patients -- Number of patients entering the hospital during the year
+    - human_infection -- Human to human infection probability
+    - human_contamination -- Human to object contamination probability
+    - chair_infection -- Chair to human infection probability
+    - bed_infection -- Bed to human infection probability
+    - icu_chance -- ICU environment infection probability
+    - walk_speed -- Patients walk speed
+    """
+    hospital = sim.Hospital(WIDTH, HEIGHT)
+    hospital.elements.extend(hospital_elements())
+
+    year, day = reference_tables()
+
+    daily = (year['admission_distribution'] * patients).round().to_numpy()
+    influx = np.outer(daily, day[:, 0]).round().astype('int64')
+    infected_percentage = year['pneumonia_probability'].to_numpy()
+
+    hospital.parameters = {
+        'human': {
+            'infect_distance': 2.0,
+            'contamination_probability': human_contamination,
+            'incubation_time': INCUBATION_TIME,
+            'infect_probability': human_infection
+        },
+        'objects': {
+            'chair': {
+                'infect_probability': chair_infection,
+                'cleaning_interval': CLEANING_INTERVAL
+            },
+            'bed': {
+                'infect_probability': bed_infection,
+                'cleaning_interval': CLEANING_INTERVAL
+            }
+        },
+        'icu': ICU,
+        'reception': RECEPTION,
+        'triage': TRIAGE,
+        'doctors': DOCTORS,
+        'patient': {
+            'walk_speed': walk_speed,
+            'infected_probability': infected_percentage,
+            'influx': influx
+        },
+        'personnel': PERSONNEL,
+        'environments': {
+            'icu': {
+                'infection_probability': icu_chance
+            }
+        }
+    }
+
+    hospital.validate()
+
+    return hospital
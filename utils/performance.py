@@ -1,12 +1,35 @@
 #!/usr/bin/python3
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 import glob
 import matplotlib.pyplot as plt
 import pandas as pd
 import re
 
+# Per-process metric files are named <metric>.p<process>.csv
+PROCESS_FILE_RE = re.compile(r'\.p(\d+)\.csv$')
+
+
+def read_process_files(folderpath, name):
+    """
+    Read the per-process CSV files of a metric concurrently, adding the
+    process number to each one
+
+    Keyword arguments:
+
+    - folderpath -- The folder of the simulation run
+    - name -- The metric name, i.e. tick_metrics
+    """
+    paths = glob.glob(f"{folderpath}/{name}.p*.csv")
+    with ThreadPoolExecutor() as executor:
+        dfs = list(executor.map(pd.read_csv, paths))
+
+    for path, df in zip(paths, dfs):
+        df['process'] = int(PROCESS_FILE_RE.search(path)[1])
+    return dfs
+
 
 class Metrics(object):
     """
@@ -25,17 +48,10 @@ class Metrics(object):
 
     def __init__(self, folderpath):
 
-        tick_files = glob.glob(f"{folderpath}/tick_metrics.p*.csv")
+        tick_dfs = read_process_files(folderpath, 'tick_metrics')
 
         # Per tick metrics can be disable, so the the file may no exist
-        if tick_files:
-            tick_dfs = []
-            for tick_path in tick_files:
-                tick_df = pd.read_csv(tick_path)
-                process = int(
-                    re.match(r'.+tick_metrics\.p(\d+)\.csv', tick_path)[1])
-                tick_df['process'] = process
-                tick_dfs.append(tick_df)
+        if tick_dfs:
             tmp_df = pd.concat(tick_dfs)
 
             # Convert to a more usable format
@@ -56,15 +72,8 @@ class Metrics(object):
             self.ticks['total_mpi_sync'] = self.ticks[[
                 *self.mpi_stages]].sum(axis='columns')
 
-        global_files = glob.glob(f"{folderpath}/global_metrics.p*.csv")
-        global_dfs = []
-        for global_path in global_files:
-            global_df = pd.read_csv(global_path)
-            process = int(
-                re.match(r'.+global_metrics\.p(\d+)\.csv', global_path)[1])
-            global_df['process'] = process
-            global_dfs.append(global_df)
-        self.global_df = pd.concat(global_dfs)
+        self.global_df = pd.concat(read_process_files(folderpath,
+                                                      'global_metrics'))
 
     @property
     def total_time(self):
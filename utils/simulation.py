@@ -12,6 +12,25 @@ import random
 import numpy as np
 import inspect
 import json
+import math
+
+# orjson is optional, it only speeds up writing the hospital file
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def coordinates(xs, ys):
+    """
+    Every (x, y) combination of the given coordinates, as an (N, 2) array
+
+    Keyword arguments:
+
+    - xs -- An int or an iterable of ints with the x coordinates
+    - ys -- An int or an iterable of ints with the y coordinates
+    """
+    return np.stack(np.meshgrid(xs, ys, indexing='ij'), axis=-1).reshape(-1, 2)
 
 
 class Point(object):
@@ -24,6 +43,9 @@ class Point(object):
     - y -- The y coordinate
     """
 
+    # There is one Point per wall, keep them free of a per-instance __dict__
+    __slots__ = ('_x', '_y')
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -54,6 +76,8 @@ class TimePeriod(object):
     An interval of time
     """
 
+    __slots__ = ('_days', '_hours', '_minutes', '_seconds')
+
     def __init__(self, days, hours, minutes, seconds):
         self.days = days
         self.hours = hours
@@ -102,19 +126,24 @@ class TimePeriod(object):
 
 
 class Encoder(JSONEncoder):
+    """JSON encoder for the simulation types, dispatched by exact type"""
+
+    encoders = {
+        Point: lambda obj: {'x': obj.x, 'y': obj.y},
+        TimePeriod: lambda obj: {
+            'days': obj.days,
+            'hours': obj.hours,
+            'minutes': obj.minutes,
+            'seconds': obj.seconds
+        },
+        np.ndarray: lambda obj: obj.tolist()
+    }
+
     def default(self, obj):
-        if isinstance(obj, Point):
-            return {'x': obj.x, 'y': obj.y}
-        if isinstance(obj, TimePeriod):
-            return {
-                'days': obj.days,
-                'hours': obj.hours,
-                'minutes': obj.minutes,
-                'seconds': obj.seconds
-            }
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return json.JSONEncoder.default(self, obj)
+        encode = self.encoders.get(type(obj))
+        if encode is None:
+            return json.JSONEncoder.default(self, obj)
+        return encode(obj)
 
 
 class Parameters(object):
@@ -139,8 +168,9 @@ class Parameters(object):
         for parameter in self.parameters:
             parameter.validate(values, accumulators)
 
+        # Sums like 0.2 + 0.8 can land just below 1 due to rounding
         for acc in accumulators:
-            if accumulators[acc] < 1:
+            if accumulators[acc] < 1 and not math.isclose(accumulators[acc], 1):
                 raise Exception((f"Probability group {acc} does not sum 1: "
                                  f"{accumulators[acc]}"))
 
@@ -205,16 +235,17 @@ class Parameter(object):
 
         if self.key not in values:
             raise Exception(f"Missing parameter {self.full_key}")
+        value = values[self.key]
 
         # If the Parameter is a list of Parameters, iterate over all the elements
         # of the value validating each one
         if self.islist:
-            if not isinstance(values[self.key], list):
+            if not isinstance(value, list):
                 raise Exception(f"{self.full_key} must be a list")
 
-            if len(values[self.key]) == 0:
+            if len(value) == 0:
                 raise Exception(f"List {self.full_key} is empty")
-            for element in values[self.key]:
+            for element in value:
 
                 for req_param in self.type:
                     req_param.validate(element, accumulators)
@@ -222,34 +253,32 @@ class Parameter(object):
 
             # If the type is a set of parameters, validate each one
             if isinstance(self.type, set):
+                if not isinstance(value, dict):
+                    raise Exception(f"{self.full_key} should be a dict")
                 for parameter in self.type:
-                    if not isinstance(values[self.key], dict):
-                        raise Exception(f"{self.full_key} should be a dict")
-                    parameter.validate(values[self.key], accumulators)
+                    parameter.validate(value, accumulators)
 
             # Otherwise is a concrete type, perform a proper validation
             else:
-                if not isinstance(values[self.key], self.type):
+                if not isinstance(value, self.type):
                     raise Exception(
                         f"{self.full_key} should be {self.type.__name__}")
 
                 if self.probability:
-                    if not 0 <= values[self.key] < 1:
+                    if not 0 <= value < 1:
                         raise Exception(
                             f"{self.full_key} outside range [0, 1)")
 
                 if self.pgroup is not None:
-                    try:
-                        accumulators[self.pgroup] += values[self.key]
-                    except:
-                        accumulators[self.pgroup] = values[self.key]
+                    accumulators[self.pgroup] = accumulators.get(
+                        self.pgroup, 0) + value
 
                     if accumulators[self.pgroup] > 1.01:
                         raise Exception(('Probability accumulator overflow for '
                                          f"group {self.pgroup}"))
 
                 if self.validator is not None:
-                    ok, diagnose = self.validator(values[self.key])
+                    ok, diagnose = self.validator(value)
                     if not ok:
                         raise Exception(f"{self.full_key} {diagnose}")
 
@@ -370,17 +399,23 @@ class Hospital(object):
 
     def add_element(self, element):
         """Add a new 'element' to the Hospital"""
-        if not issubclass(element.__class__, HospitalElement):
+        if not isinstance(element, HospitalElement):
             raise Exception(
                 'The element to add must be subclass of HospitalElement')
         self.elements.append(element)
 
+    def add_walls(self, coordinates):
+        """Add a Wall in each of the (x, y) rows of 'coordinates'"""
+        self.elements.extend(Wall((x, y))
+                             for x, y in np.asarray(coordinates).tolist())
+
     def validate(self):
         """Check the parameters and the elements"""
 
         # Make sure doctors in the map have their respective properties
-        for doctor in [x for x in self.elements if isinstance(x, DoctorOffice)]:
-            if doctor.specialty not in [d['specialty'] for d in self.parameters['doctors']]:
+        specialties = {d['specialty'] for d in self.parameters['doctors']}
+        for doctor in self.elements:
+            if isinstance(doctor, DoctorOffice) and doctor.specialty not in specialties:
                 raise Exception(
                     f"Missing parameters for doctor '{doctor.specialty}'")
 
@@ -394,11 +429,23 @@ class Hospital(object):
             },
             'parameters': self.parameters
         }
+
+        # Walls are most of the elements, collect them in one pass instead of
+        # dispatching store() for each one
+        walls = [e.location for e in self.elements if type(e) is Wall]
+        if walls:
+            data['building'][Wall.store_key] = walls
         for element in self.elements:
-            element.store(data)
+            if type(element) is not Wall:
+                element.store(data)
 
-        with open(f"{folder}/{filename}", 'w') as f:
-            json.dump(data, f, cls=Encoder)
+        if orjson is not None:
+            with open(f"{folder}/{filename}", 'wb') as f:
+                f.write(orjson.dumps(data, default=Encoder().default,
+                                     option=orjson.OPT_SERIALIZE_NUMPY))
+        else:
+            with open(f"{folder}/{filename}", 'w') as f:
+                json.dump(data, f, cls=Encoder)
 
     def plot(self):
         return HospitalPlotter(self)
@@ -418,10 +465,9 @@ class HospitalPlotter(object):
         for element in self.elements:
             element.put_char_art(self.plan)
 
-        for y in range(len(self.plan[0]) - 1, -1, -1):
-            for x in range(len(self.plan)):
-                print(self.plan[x][y], end='')
-            print()
+        # Rows are printed from the top (highest y) down
+        rows = list(zip(*self.plan))
+        print('\n'.join(''.join(row) for row in reversed(rows)))
 
 
 class HospitalElement(object):
@@ -429,6 +475,8 @@ class HospitalElement(object):
     An element inside the hospital with physical presence
     """
 
+    __slots__ = ()
+
     unique = None
     store_key = None
     location = None
@@ -440,12 +488,8 @@ class HospitalElement(object):
         if self.unique:
             dictionary['building'][self.store_key] = self.location
         else:
-            try:
-                dictionary['building'][self.store_key].append(
-                    self.location)
-            except:
-                dictionary['building'][self.store_key] = [
-                    self.location]
+            dictionary['building'].setdefault(self.store_key, []).append(
+                self.location)
 
     def put_char_art(self, plan):
         """Store this element in a matrix of chars according to its location"""
@@ -465,6 +509,8 @@ class DoctorOffice(HospitalElement):
     unique = False
     store_key = 'doctors'
 
+    __slots__ = ('specialty', 'doctor_location', 'patient_location')
+
     def __init__(self, specialty, doctor_location, patient_location):
         self.specialty = specialty
         self.doctor_location = Point(*doctor_location)
@@ -476,10 +522,7 @@ class DoctorOffice(HospitalElement):
             'doctor_location': self.doctor_location,
             'patient_location': self.patient_location
         }
-        try:
-            dictionary['building'][self.store_key].append(data)
-        except:
-            dictionary['building'][self.store_key] = [data]
+        dictionary['building'].setdefault(self.store_key, []).append(data)
 
     def put_char_art(self, plan):
         plan[self.doctor_location.x][self.doctor_location.y] = 'D'
@@ -499,6 +542,8 @@ class Wall(HospitalElement):
     char_art = '#'
     plot_color = 'black'
 
+    __slots__ = ('location',)
+
     def __init__(self, location):
         self.location = Point(*location)
 
@@ -516,6 +561,8 @@ class Chair(HospitalElement):
     char_art = 'h'
     plot_color = 'grey'
 
+    __slots__ = ('location',)
+
     def __init__(self, location):
         self.location = Point(*location)
 
@@ -533,6 +580,8 @@ class Entry(HospitalElement):
     char_art = 'E'
     plot_color = 'green'
 
+    __slots__ = ('location',)
+
     def __init__(self, location):
         self.location = Point(*location)
 
@@ -550,6 +599,8 @@ class Exit(HospitalElement):
     char_art = 'X'
     plot_color = 'red'
 
+    __slots__ = ('location',)
+
     def __init__(self, location):
         self.location = Point(*location)
 
@@ -566,6 +617,8 @@ class ICU(HospitalElement):
     store_key = 'icu'
     char_art = 'I'
 
+    __slots__ = ('location',)
+
     def __init__(self, location):
         self.location = Point(*location)
 
@@ -583,6 +636,8 @@ class Triage(HospitalElement):
     store_key = 'triages'
     char_art = 'T'
 
+    __slots__ = ('patient_location',)
+
     def __init__(self, patient_location):
         self.patient_location = Point(*patient_location)
 
@@ -590,10 +645,7 @@ class Triage(HospitalElement):
         data = {
             'patient_location': self.patient_location
         }
-        try:
-            dictionary['building'][self.store_key].append(data)
-        except:
-            dictionary['building'][self.store_key] = [data]
+        dictionary['building'].setdefault(self.store_key, []).append(data)
 
     def put_char_art(self, plan):
         plan[self.patient_location.x][self.patient_location.y] = self.char_art
@@ -611,6 +663,8 @@ class Receptionist(HospitalElement):
     unique = False
     store_key = 'receptionists'
 
+    __slots__ = ('receptionist_location', 'patient_location')
+
     def __init__(self, receptionist_location, patient_location):
         self.receptionist_location = Point(*receptionist_location)
         self.patient_location = Point(*patient_location)
@@ -620,10 +674,7 @@ class Receptionist(HospitalElement):
             'receptionist_location': self.receptionist_location,
             'patient_location': self.patient_location
         }
-        try:
-            dictionary['building'][self.store_key].append(data)
-        except:
-            dictionary['building'][self.store_key] = [data]
+        dictionary['building'].setdefault(self.store_key, []).append(data)
 
     def put_char_art(self, plan):
         plan[self.receptionist_location.x][self.receptionist_location.y] = 'R'